@@ -1,32 +1,260 @@
 import base64
+import functools
+import io
 import json
-import math
 import os
-from typing import List, Dict, Any
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Optional, Tuple, Union
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to the standard json module
+    orjson = None
+
+# Number of raw bytes read per block when Base64 encoding (must be a multiple of 3)
+ENCODE_CHUNK_SIZE = 3 * 65536
+
+# Header of the data URLs used to embed images in the request
+DATA_URL_PREFIX = b"data:image/png;base64,"
+
+# Leading bytes of every PNG file
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Placeholders for the per-call values of the payload template, in the order they are serialized
+PAYLOAD_PLACEHOLDERS = ("@@WIDTH@@", "@@HEIGHT@@", "@@IMAGE1@@", "@@IMAGE2@@")
+
+# Target size of each chunk of a streamed request body
+BODY_CHUNK_SIZE = 1 << 16
+
+# File extension and PIL save options for each supported cropped-region output format
+OUTPUT_FORMATS = {
+    "webp": ("webp", {"format": "WEBP", "quality": 85, "method": 4}),
+    "jpeg": ("jpg", {"format": "JPEG", "quality": 85}),
+    "png": ("png", {"format": "PNG", "optimize": False, "compress_level": 1}),
+}
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """
+    Serialize an object to JSON bytes, using orjson when available
+
+    :param obj: Object to serialize
+    :return: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(data: Any) -> Any:
+    """
+    Deserialize JSON from bytes or str, using orjson when available
+
+    :param data: JSON document
+    :return: Deserialized object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _ascii_chunks(text: str):
+    """
+    Split ASCII text into encoded chunks of at most BODY_CHUNK_SIZE bytes
+
+    :param text: ASCII text
+    :return: Iterator of bytes chunks
+    """
+    for start in range(0, len(text), BODY_CHUNK_SIZE):
+        yield text[start:start + BODY_CHUNK_SIZE].encode("ascii")
+
+
+class _PayloadTemplate:
+    """
+    Payload serialized once with placeholders where the per-call values go
+
+    The JSON around the placeholders is kept as pre-encoded slabs, so rendering only
+    interleaves them with the values. This is valid only for values that need no JSON
+    escaping: numbers and data URLs, whose Base64 alphabet has no quotes or backslashes.
+    """
+    def __init__(self, payload: Dict[str, Any], placeholders: Tuple[str, ...]):
+        serialized = json.dumps(payload, separators=(",", ":"))
+        self.slabs = []
+        # Placeholders must be listed in the order they appear in the serialized payload
+        for placeholder in placeholders:
+            head, found, serialized = serialized.partition(placeholder)
+            if not found:
+                raise ValueError(f"Placeholder not found in payload template: {placeholder}")
+            self.slabs.append(head.encode("ascii"))
+        self.slabs.append(serialized.encode("ascii"))
+
+    def render(self, *values: Any) -> "_TemplateBody":
+        """
+        Fill the placeholders with values
+
+        :param values: Values in placeholder order
+        :return: Request body
+        """
+        return _TemplateBody(self.slabs, [str(value) for value in values])
+
+
+class _TemplateBody:
+    """
+    Request body rendered from a _PayloadTemplate
+
+    requests sends iterables with chunked transfer encoding, so the complete JSON
+    document is never held in memory next to the encoded images. Each iteration starts
+    from the beginning, which lets retries resend the body.
+    """
+    def __init__(self, slabs: List[bytes], values: List[str]):
+        self.slabs = slabs
+        self.values = values
+
+    def __iter__(self):
+        for slab, value in zip(self.slabs, self.values):
+            yield slab
+            yield from _ascii_chunks(value)
+        yield self.slabs[-1]
+
+
+@functools.lru_cache(maxsize=32)
+def _read_image_dimensions(image_path: str, mtime_ns: int) -> (int, int):
+    """
+    Read the dimensions of an image; mtime_ns is only part of the cache key
+
+    :param image_path: Path of the image to get dimensions
+    :param mtime_ns: Modification time of the image in nanoseconds
+    :return: Tuple of (width, height)
+    """
+    # PNG stores width and height at fixed offsets in the IHDR chunk, which must
+    # come first, so read them from the header instead of opening the image with PIL.
+    # Other formats, and truncated or malformed PNGs, go through PIL.
+    with open(image_path, "rb") as image_file:
+        header = image_file.read(24)
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+
+    with Image.open(image_path) as img:
+        return img.size  # returns (width, height)
+
 
 class ImageDifferenceFinder:
-    def __init__(self, api_key: str, model: str = "gpt-4"):
+    def __init__(self, api_key: str, model: str = "gpt-4o", output_format: str = "webp", max_edge: Optional[int] = 1024):
         """
         Constructor: Receives the OpenAI API key and model name
 
         :param api_key: OpenAI API key
-        :param model: Model to be used, defaults to "gpt-4"
+        :param model: Model to be used (must accept image input), defaults to "gpt-4o"
+        :param output_format: Format of the saved cropped regions ("webp", "jpeg" or "png"), defaults to "webp"
+        :param max_edge: Longest side (px) of images sent to the API, larger images are downscaled;
+                         None sends images at full resolution. Defaults to 1024
         """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}. Choose from {', '.join(OUTPUT_FORMATS)}.")
+
         self.api_key = api_key
         self.model = model
+        self.output_format = output_format
+        self.max_edge = max_edge
+
+        # Encoded images keyed by (path, mtime, size, max_edge), so an image reused across calls is encoded once
+        self._encode_payload_image_cached = functools.lru_cache(maxsize=8)(self._encode_payload_image)
+
+        # Static part of the payload as (model, template), serialized on first use and
+        # filled in per call by prepare_body; rebuilt whenever self.model changes
+        self._payload_template = None
+
+        # Reuse one pooled session so TCP/TLS setup happens once across requests;
+        # rate-limit and server errors, and failures to connect, are retried with exponential
+        # backoff. Read errors are not: the POST may already have been processed and billed.
+        retry = Retry(total=5, read=0, other=0, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["POST"], raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=16, max_retries=retry))
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        })
     
-    def encode_image(self, image_path: str) -> str:
+    def encode_image(self, image_path: str, prefix: bytes = b"") -> str:
         """
         Encode an image file to a Base64 string
 
         :param image_path: Path of the image to encode
+        :param prefix: ASCII bytes placed before the encoded data (e.g. a data URL header)
         :return: Base64 encoded image string
         """
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        with open(image_path, "rb", buffering=1 << 20) as image_file:
+            # Allocate the full output up front so the prefix and every encoded block
+            # are written into one buffer that is decoded to str exactly once
+            size = os.fstat(image_file.fileno()).st_size
+            encoded = bytearray(len(prefix) + 4 * ((size + 2) // 3))
+            encoded[:len(prefix)] = prefix
+            position = len(prefix)
+            # Read in blocks whose size is a multiple of 3 so that no padding is
+            # emitted mid-stream and the encoded chunks can simply be concatenated.
+            while chunk := image_file.read(ENCODE_CHUNK_SIZE):
+                block = base64.b64encode(chunk)
+                encoded[position:position + len(block)] = block
+                position += len(block)
+        return str(memoryview(encoded)[:position], "ascii")
     
+    def encode_resized_image(self, image_path: str, max_edge: int, prefix: bytes = b"") -> str:
+        """
+        Downscale an image so its longest side is at most max_edge and encode it as a Base64 PNG string
+
+        :param image_path: Path of the image to encode
+        :param max_edge: Maximum length (px) of the longest side
+        :param prefix: ASCII bytes placed before the encoded data (e.g. a data URL header)
+        :return: Base64 encoded image string
+        """
+        with Image.open(image_path) as img:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG", compress_level=1)
+        return str(prefix + base64.b64encode(buffer.getbuffer()), "ascii")
+
+    def encode_payload_image(self, image_path: str) -> str:
+        """
+        Encode an image as a data URL for the API request, downscaling it if it exceeds max_edge
+
+        :param image_path: Path of the image to encode
+        :return: Data URL of the image
+        """
+        stat = os.stat(image_path)
+        return self._encode_payload_image_cached(image_path, stat.st_mtime_ns, stat.st_size, self.max_edge)
+
+    def _encode_payload_image(self, image_path: str, mtime_ns: int, size: int, max_edge: Optional[int]) -> str:
+        """
+        Encode an image as a data URL; mtime_ns and size are only part of the cache key
+
+        :param image_path: Path of the image to encode
+        :param mtime_ns: Modification time of the image in nanoseconds
+        :param size: Size of the image file in bytes
+        :param max_edge: Longest side (px) the image is downscaled to, None for full resolution
+        :return: Data URL of the image
+        """
+        if max_edge and max(self.get_image_dimensions(image_path)) > max_edge:
+            return self.encode_resized_image(image_path, max_edge, DATA_URL_PREFIX)
+        return self.encode_image(image_path, DATA_URL_PREFIX)
+
+    def get_scale(self, width: int, height: int) -> float:
+        """
+        Get the factor applied to an image's size before it is sent to the API
+
+        :param width: Width of the image
+        :param height: Height of the image
+        :return: Scale factor, 1.0 if the image is not downscaled
+        """
+        if not self.max_edge or max(width, height) <= self.max_edge:
+            return 1.0
+        return self.max_edge / max(width, height)
+
     def get_image_dimensions(self, image_path: str) -> (int, int):
         """
         Get the dimensions of an image
@@ -34,8 +262,8 @@ class ImageDifferenceFinder:
         :param image_path: Path of the image to get dimensions
         :return: Tuple of (width, height)
         """
-        with Image.open(image_path) as img:
-            return img.size  # returns (width, height)
+        # Cached per file version so repeated lookups skip reopening the image
+        return _read_image_dimensions(image_path, os.stat(image_path).st_mtime_ns)
     
     def prepare_payload(self, image_path1: str, image_path2: str) -> Dict[str, Any]:
         """
@@ -45,119 +273,212 @@ class ImageDifferenceFinder:
         :param image_path2: Path of the second image
         :return: API request payload
         """
-        base64_image1 = self.encode_image(image_path1)
-        base64_image2 = self.encode_image(image_path2)
+        return self._build_payload(*self._prepare_payload_values(image_path1, image_path2))
+
+    def prepare_body(self, image_path1: str, image_path2: str) -> _TemplateBody:
+        """
+        Prepare the serialized body for the OpenAI API request from the payload template
+
+        :param image_path1: Path of the first image
+        :param image_path2: Path of the second image
+        :return: API request body, equivalent to the JSON of prepare_payload
+        """
+        return self._get_payload_template().render(*self._prepare_payload_values(image_path1, image_path2))
 
+    def _get_payload_template(self) -> _PayloadTemplate:
+        """
+        Get the payload template for the current model, building it if needed
+
+        :return: Payload template
+        """
+        model = self.model
+        cached = self._payload_template
+        if cached is None or cached[0] != model:
+            template = _PayloadTemplate(self._build_payload(*PAYLOAD_PLACEHOLDERS), PAYLOAD_PLACEHOLDERS)
+            cached = (model, template)
+            self._payload_template = cached
+        return cached[1]
+
+    def _prepare_payload_values(self, image_path1: str, image_path2: str) -> Tuple[int, int, str, str]:
+        """
+        Compute the per-call values of the payload
+
+        :param image_path1: Path of the first image
+        :param image_path2: Path of the second image
+        :return: Tuple of (width, height, data URL of image 1, data URL of image 2)
+        """
+        # The model sees the downscaled image, so its size is what goes into the prompt
         width, height = self.get_image_dimensions(image_path1)
-        
+        scale = self.get_scale(width, height)
+        width, height = round(width * scale), round(height * scale)
+
+        # Encoding the two images is independent and I/O-bound, so run both concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_image1 = executor.submit(self.encode_payload_image, image_path1)
+            future_image2 = executor.submit(self.encode_payload_image, image_path2)
+            data_url1 = future_image1.result()
+            data_url2 = future_image2.result()
+
+        return width, height, data_url1, data_url2
+
+    def _build_payload(self, width: Any, height: Any, data_url1: str, data_url2: str) -> Dict[str, Any]:
+        """
+        Build the payload for the OpenAI API request
+
+        :param width: Width of the images as sent
+        :param height: Height of the images as sent
+        :param data_url1: Data URL of the first image
+        :param data_url2: Data URL of the second image
+        :return: API request payload
+        """
         payload = {
             "model": self.model,
             "messages": [
                 {
                     "role": "user",
-                    "content": f"Please find the differences between two images of size {width}*{height}. Provide the rectangular regions (position, width, height) that enclose the differences. Return the results in an array as there may be multiple differences.",
-                    "image1": f"data:image/png;base64,{base64_image1}",
-                    "image2": f"data:image/png;base64,{base64_image2}"
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": f"Please find the differences between two images of size {width}*{height}. Provide the rectangular regions (position, width, height) that enclose the differences. Return the results in an array as there may be multiple differences."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": data_url1}
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": data_url2}
+                        }
+                    ]
                 }
             ],
-            "functions": [
+            "tools": [
                 {
-                    "name": "image_diff",
-                    "description": "Region definition for image difference",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "regions": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "position_x": {
-                                            "type": "number",
-                                            "description": "X coordinate of the clipping region (top-left, px)",
-                                        },
-                                        "position_y": {
-                                            "type": "number",
-                                            "description": "Y coordinate of the clipping region (top-left, px)",
-                                        },
-                                        "width": {
-                                            "type": "number",
-                                            "description": "Width of the clipping region (px)",
+                    "type": "function",
+                    "function": {
+                        "name": "image_diff",
+                        "description": "Region definition for image difference",
+                        "strict": True,
+                        "parameters": {
+                            "type": "object",
+                            "properties": {
+                                "regions": {
+                                    "type": "array",
+                                    "items": {
+                                        "type": "object",
+                                        "properties": {
+                                            "position_x": {
+                                                "type": "number",
+                                                "description": "X coordinate of the clipping region (top-left, px)",
+                                            },
+                                            "position_y": {
+                                                "type": "number",
+                                                "description": "Y coordinate of the clipping region (top-left, px)",
+                                            },
+                                            "width": {
+                                                "type": "number",
+                                                "description": "Width of the clipping region (px)",
+                                            },
+                                            "height": {
+                                                "type": "number",
+                                                "description": "Height of the clipping region (px)",
+                                            }
                                         },
-                                        "height": {
-                                            "type": "number",
-                                            "description": "Height of the clipping region (px)",
-                                        }
-                                    },
-                                    "required": ["position_x", "position_y", "width", "height"]
+                                        "required": ["position_x", "position_y", "width", "height"],
+                                        "additionalProperties": False
+                                    }
                                 }
-                            }
-                        },
-                        "required": ["regions"]
+                            },
+                            "required": ["regions"],
+                            "additionalProperties": False
+                        }
                     }
                 }
             ],
-            "function_call": {"name": "image_diff"},
+            "tool_choice": {"type": "function", "function": {"name": "image_diff"}},
+            "parallel_tool_calls": False,
             "max_tokens": 300
         }
 
         return payload
 
-    def query_openai(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def query_openai(self, payload: Union[Dict[str, Any], _TemplateBody]) -> Dict[str, Any]:
         """
         Query the OpenAI API
 
-        :param payload: API request payload
+        :param payload: API request payload, or a body from prepare_body
         :return: API response data
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        # Template bodies are streamed; plain payloads are serialized in one go (orjson when available)
+        body = payload if isinstance(payload, _TemplateBody) else _json_dumps(payload)
+        response = self.session.post("https://api.openai.com/v1/chat/completions", data=body)
 
         if response.status_code != 200:
             print(f"Error: {response.status_code}")
             try:
-                print(response.json())
-            except json.JSONDecodeError:
+                print(_json_loads(response.content))
+            except json.JSONDecodeError:  # orjson.JSONDecodeError is a subclass
                 print("Response content is not valid JSON.")
             return None
         else:
-            return response.json()
+            return _json_loads(response.content)
     
     def merge_and_adjust_regions(self, regions: List[Dict[str, int]], distance_threshold: int, margin: int, width: int, height: int) -> List[Dict[str, int]]:
         """
         Merge and adjust overlapping regions
 
         :param regions: List of region information
-        :param distance_threshold: Distance threshold for merging
+        :param distance_threshold: Maximum gap between regions for merging
         :param margin: Margin around the region
         :param width: Width of the image
         :param height: Height of the image
         :return: Adjusted list of regions
         """
-        def distance(r1, r2):
-            center1 = (r1["position_x"] + r1["width"] / 2, r1["position_y"] + r1["height"] / 2)
-            center2 = (r2["position_x"] + r2["width"] / 2, r2["position_y"] + r2["height"] / 2)
-            return math.sqrt((center1[0] - center2[0]) ** 2 + (center1[1] - center2[1]) ** 2)
+        # Extract bounds once; two regions are merged when the gap between them
+        # is at most distance_threshold on both axes
+        bounds = [(r["position_x"], r["position_y"], r["position_x"] + r["width"], r["position_y"] + r["height"])
+                  for r in regions]
+
+        # Union-find over region indices; regions linked by close pairs end up in the same group
+        parent = list(range(len(regions)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # Sweep over regions sorted by left edge: once a region starts further than the
+        # threshold right of the current one, no later region in the order can be close.
+        # The threshold is applied to the current region's bounds once, outside the inner
+        # loop, so each pair check is just three comparisons.
+        order = sorted(range(len(regions)), key=lambda i: bounds[i][0])
+        for pos in range(len(order)):
+            i = order[pos]
+            _, top_i, right_i, bottom_i = bounds[i]
+            reach_top = top_i - distance_threshold
+            reach_right = right_i + distance_threshold
+            reach_bottom = bottom_i + distance_threshold
+            for other in range(pos + 1, len(order)):
+                j = order[other]
+                left_j, top_j, _, bottom_j = bounds[j]
+                if left_j > reach_right:
+                    break
+                if top_j <= reach_bottom and reach_top <= bottom_j:
+                    parent[find(j)] = find(i)
+
+        groups = {}
+        for i in range(len(regions)):
+            groups.setdefault(find(i), []).append(i)
 
         merged_regions = []
 
-        while regions:
-            region = regions.pop(0)
-            overlapping_regions = [region]
-            
-            for other in list(regions):
-                if distance(region, other) <= distance_threshold:
-                    overlapping_regions.append(other)
-                    regions.remove(other)
-            
-            min_x = min(r["position_x"] for r in overlapping_regions) - margin
-            min_y = min(r["position_y"] for r in overlapping_regions) - margin
-            max_x = max(r["position_x"] + r["width"] for r in overlapping_regions) + margin
-            max_y = max(r["position_y"] + r["height"] for r in overlapping_regions) + margin
+        for group in groups.values():
+            left, top, right, bottom = zip(*(bounds[i] for i in group))
+            min_x = min(left) - margin
+            min_y = min(top) - margin
+            max_x = max(right) + margin
+            max_y = max(bottom) + margin
             
             min_x = max(min_x, 0)
             min_y = max(min_y, 0)
@@ -176,7 +497,7 @@ class ImageDifferenceFinder:
 
         return merged_regions
     
-    def save_cropped_region(self, image: Image.Image, region: Dict[str, int], original_filename: str, index: int):
+    def save_cropped_region(self, image: Image.Image, region: Dict[str, int], original_filename: str, index: int, name_suffix: str = ""):
         """
         Crop and save the region
 
@@ -184,52 +505,107 @@ class ImageDifferenceFinder:
         :param region: Dictionary of the region to crop
         :param original_filename: Original image filename
         :param index: Index of the saved file
+        :param name_suffix: Text appended to the original file stem, to keep output names unique
         """
         cropped_image = image.crop((region["position_x"], region["position_y"], 
                                     region["position_x"] + region["width"], region["position_y"] + region["height"]))
-        filename = f"{os.path.splitext(original_filename)[0]}_diff{index}.png"
-        cropped_image.save(filename)
+        extension, save_options = OUTPUT_FORMATS[self.output_format]
+        if self.output_format == "jpeg" and cropped_image.mode not in ("RGB", "L"):
+            cropped_image = cropped_image.convert("RGB")  # JPEG has no alpha or palette support
+        filename = f"{os.path.splitext(original_filename)[0]}{name_suffix}_diff{index}.{extension}"
+        cropped_image.save(filename, **save_options)
         print(f"Saved: {filename}")
 
-    def process_images(self, image_path1: str, image_path2: str, distance_threshold: int = 250, margin: int = 100):
+    def process_images(self, image_path1: str, image_path2: str, distance_threshold: int = 250, margin: int = 100,
+                       name_suffix: str = "") -> Optional[List[Dict[str, int]]]:
         """
         Process the images to detect differences
 
         :param image_path1: Path of the first image
         :param image_path2: Path of the second image
-        :param distance_threshold: Distance threshold for merging
+        :param distance_threshold: Maximum gap between regions for merging
         :param margin: Margin around the region
+        :param name_suffix: Text appended to the stems of the saved cropped-region files
+        :return: Adjusted list of regions (empty if there are no differences), or None on error
         """
-        payload = self.prepare_payload(image_path1, image_path2)
-        result = self.query_openai(payload)
+        body = self.prepare_body(image_path1, image_path2)
+        result = self.query_openai(body)
 
         if result:
             if "choices" in result and len(result["choices"]) > 0:
                 for choice in result["choices"]:
                     message = choice.get("message", {})
-                    if "function_call" in message:
-                        arguments = json.loads(message["function_call"]["arguments"])
-                        regions = arguments.get("regions", [])
+                    if message.get("tool_calls"):
+                        # Collect regions from every image_diff call in case the model split them up
+                        regions = []
+                        for tool_call in message["tool_calls"]:
+                            arguments = _json_loads(tool_call["function"]["arguments"])
+                            regions.extend(arguments.get("regions", []))
                         
                         if not regions:
                             print("No differences found.")
-                            return
+                            return []
                         
                         width, height = self.get_image_dimensions(image_path1)
+
+                        # Regions refer to the image the model saw; map them back to full resolution
+                        scale = self.get_scale(width, height)
+                        if scale < 1:
+                            regions = [{key: region[key] / scale for key in ("position_x", "position_y", "width", "height")}
+                                       for region in regions]
+
                         adjusted_regions = self.merge_and_adjust_regions(regions, distance_threshold, margin, width, height)
 
+                        # Decode each image once up front; later crops then copy from the loaded pixels
                         original_image1 = Image.open(image_path1)
+                        original_image1.load()
                         original_image2 = Image.open(image_path2)
+                        original_image2.load()
 
-                        for idx, region in enumerate(adjusted_regions):
-                            self.save_cropped_region(original_image1, region, image_path1, idx + 1)
-                            self.save_cropped_region(original_image2, region, image_path2, idx + 1)
+                        # Image encoding releases the GIL, so crops of both images are saved in parallel
+                        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                            futures = []
+                            for idx, region in enumerate(adjusted_regions):
+                                futures.append(executor.submit(self.save_cropped_region, original_image1, region, image_path1, idx + 1, name_suffix))
+                                futures.append(executor.submit(self.save_cropped_region, original_image2, region, image_path2, idx + 1, name_suffix))
+                            for future in futures:
+                                future.result()
 
                         print(json.dumps(adjusted_regions, indent=2))
+                        return adjusted_regions
                     else:
-                        print("Error: Function call not found in the response")
+                        print("Error: Tool call not found in the response")
             else: 
                 print("Error: No choices found in the response")
         else:
             print("Error: Failed to get a valid response from OpenAI")
 
+    def process_many(self, pairs: Iterable[Tuple[str, str]], concurrency: int = 10, distance_threshold: int = 250,
+                     margin: int = 100) -> List[Optional[List[Dict[str, int]]]]:
+        """
+        Process multiple image pairs concurrently
+
+        Cropped regions are saved as <stem>_pair<N>_diff<M>, where N is the 1-based position
+        of the pair, so pairs sharing an image never write the same files.
+
+        :param pairs: Iterable of (image_path1, image_path2) tuples
+        :param concurrency: Maximum number of pairs processed at the same time
+        :param distance_threshold: Maximum gap between regions for merging
+        :param margin: Margin around the region
+        :return: Result of process_images for each pair, in the order of pairs; None for pairs that failed
+        """
+        pairs = list(pairs)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.process_images, image_path1, image_path2, distance_threshold, margin,
+                                       f"_pair{pair_index}")
+                       for pair_index, (image_path1, image_path2) in enumerate(pairs, start=1)]
+
+            # A failing pair must not discard the results of the others
+            results = []
+            for (image_path1, image_path2), future in zip(pairs, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Error: Failed to process {image_path1} and {image_path2}: {e}")
+                    results.append(None)
+            return results
@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from image_difference_finder import ImageDifferenceFinder, _json_dumps
+
+
+class PayloadTemplateTest(unittest.TestCase):
+    def test_body_matches_payload_after_model_change(self):
+        finder = ImageDifferenceFinder("test-key")
+        image_path1 = "image_before.png"
+        image_path2 = "image_after.png"
+
+        for model in (finder.model, "gpt-4.1"):
+            finder.model = model
+            body = b"".join(finder.prepare_body(image_path1, image_path2))
+            self.assertEqual(body, _json_dumps(finder.prepare_payload(image_path1, image_path2)))
+            self.assertIn(f'"model":"{model}"'.encode("ascii"), body)
+
+
+def region(x, y, width, height):
+    return {"position_x": x, "position_y": y, "width": width, "height": height}
+
+
+class MergeRegionsTest(unittest.TestCase):
+    def setUp(self):
+        self.finder = ImageDifferenceFinder("test-key")
+
+    def merge(self, regions, distance_threshold, margin=0, width=10000, height=10000):
+        return self.finder.merge_and_adjust_regions(regions, distance_threshold, margin, width, height)
+
+    def test_gap_of_exactly_threshold_merges(self):
+        merged = self.merge([region(0, 0, 10, 10), region(30, 0, 10, 10)], 20)
+        self.assertEqual(merged, [region(0, 0, 40, 10)])
+
+    def test_gap_above_threshold_does_not_merge(self):
+        merged = self.merge([region(0, 0, 10, 10), region(31, 0, 10, 10)], 20)
+        self.assertEqual(merged, [region(0, 0, 10, 10), region(31, 0, 10, 10)])
+
+    def test_gap_is_checked_per_axis(self):
+        # Within the threshold on x but not on y
+        merged = self.merge([region(0, 0, 10, 10), region(5, 31, 10, 10)], 20)
+        self.assertEqual(len(merged), 2)
+
+    def test_large_rectangles_merge_by_gap_not_center_distance(self):
+        # Centers 410 px apart, far beyond the threshold, but the boxes are only 10 px apart
+        merged = self.merge([region(0, 0, 400, 400), region(410, 0, 400, 400)], 50)
+        self.assertEqual(merged, [region(0, 0, 810, 400)])
+
+        # Large boxes further apart than the threshold stay separate
+        merged = self.merge([region(0, 0, 400, 400), region(460, 0, 400, 400)], 50)
+        self.assertEqual(len(merged), 2)
+
+    def test_chain_collapses_into_one_region(self):
+        # A-B and B-C are within the threshold, A-C is not
+        merged = self.merge([region(0, 0, 10, 10), region(50, 0, 10, 10), region(25, 0, 10, 10)], 20)
+        self.assertEqual(merged, [region(0, 0, 60, 10)])
+
+    def test_margin_is_clamped_to_image_bounds(self):
+        merged = self.merge([region(5, 5, 10, 10)], 20, margin=20, width=30, height=25)
+        self.assertEqual(merged, [region(0, 0, 30, 25)])
+
+    def test_input_regions_are_not_modified(self):
+        regions = [region(0, 0, 10, 10), region(15, 0, 10, 10)]
+        self.merge(regions, 20)
+        self.assertEqual(regions, [region(0, 0, 10, 10), region(15, 0, 10, 10)])
+
+
+class DownscaleTest(unittest.TestCase):
+    def test_regions_are_mapped_back_to_full_resolution(self):
+        with tempfile.TemporaryDirectory() as directory:
+            image_path1 = os.path.join(directory, "before.png")
+            image_path2 = os.path.join(directory, "after.png")
+            Image.new("RGB", (2048, 1024), "white").save(image_path1)
+            Image.new("RGB", (2048, 1024), "black").save(image_path2)
+
+            finder = ImageDifferenceFinder("test-key", output_format="png", max_edge=1024)
+            sent_bodies = []
+
+            def query_openai(body):
+                sent_bodies.append(b"".join(body))
+                # Coordinates in the 1024x512 image the model was sent
+                arguments = {"regions": [{"position_x": 100, "position_y": 50, "width": 20, "height": 10}]}
+                return {"choices": [{"message": {"tool_calls": [{"function": {"arguments": json.dumps(arguments)}}]}}]}
+
+            finder.query_openai = query_openai
+            regions = finder.process_images(image_path1, image_path2, distance_threshold=0, margin=0)
+
+            self.assertIn(b"two images of size 1024*512", sent_bodies[0])
+            self.assertEqual(regions, [region(200, 100, 40, 20)])
+            for saved_path in (os.path.join(directory, "before_diff1.png"), os.path.join(directory, "after_diff1.png")):
+                with Image.open(saved_path) as cropped:
+                    self.assertEqual(cropped.size, (40, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()